@@ -4,26 +4,322 @@ Compatible avec tous les environnements
 """
 
 import os
-import json
+import re
+import orjson
 import time
+import atexit
+import gzip
+import uuid
+import random
+import hashlib
+import sqlite3
 import requests
-from typing import Dict, List, Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Dict, Iterator, List, Optional
+from urllib.parse import urlparse
 from datetime import datetime
-from flask import Flask, request, jsonify, render_template_string
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 import threading
+import queue
+from html import unescape
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 # Configuration
 class Config:
+    # Les valeurs numériques lues dans l'environnement sont ramenées à un minimum
+    # strictement positif (0 diviserait par zéro ou bloquerait les traitements)
+    
     # Hugging Face (gratuit)
     HF_API_URL = "https://api-inference.huggingface.co/models/mistralai/Mistral-7B-Instruct-v0.1"
     HF_API_KEY = os.getenv("HF_API_KEY", "")
     
-    # Base de données locale (JSON)
-    DB_FILE = "agent_database.json"
+    # Tentatives pour obtenir un JSON valide
+    AI_JSON_ATTEMPTS = 3
+    
+    # Prompts envoyés par appel HuggingFace
+    HF_BATCH_SIZE = max(int(os.getenv("HF_BATCH_SIZE", 8)), 1)
+    
+    # Débit HuggingFace, réessais sur erreurs temporaires et coupe-circuit
+    HF_RETRIES = 5
+    HF_RPM = max(float(os.getenv("HF_RPM", 60)), 1.0)
+    HF_BURST = 10
+    CIRCUIT_THRESHOLD = 5
+    CIRCUIT_WINDOW = 30
+    CIRCUIT_RESET = 60
+    
+    # Base de données locale (SQLite en mode WAL)
+    DB_FILE = "agent_database.sqlite"
+    
+    # Ancienne base JSON, importée au premier démarrage
+    LEGACY_DB_FILE = "agent_database.json"
+    
+    # Cache des réponses IA (entrées gardées en mémoire, le reste en base)
+    AI_CACHE_SIZE = 1024
     
     # Port du serveur
     PORT = int(os.getenv("PORT", 5000))
+    
+    # Pool de connexions HTTP (keep-alive)
+    HTTP_POOL_CONNECTIONS = 100
+    HTTP_POOL_MAXSIZE = 20
+    HF_POOL_CONNECTIONS = 4
+    HF_POOL_MAXSIZE = 32
+    
+    # Pages de médias récupérées en parallèle
+    WP_FETCH_CONCURRENCY = 16
+    
+    # Images sans texte alternatif traitées à chaque passage
+    MAX_IMAGES_PER_RUN = int(os.getenv("MAX_IMAGES_PER_RUN", 10))
+    
+    # Images traitées en parallèle
+    WP_CONCURRENCY = max(int(os.getenv("WP_CONCURRENCY", 8)), 1)
+    
+    # Sites traités simultanément et taille de la file d'attente
+    WORKERS = max(int(os.getenv("WORKERS", 4)), 1)
+    QUEUE_SIZE = 1024
+    
+    # Durée de conservation de l'état des tâches terminées (secondes)
+    JOB_TTL = 3600
+    
+    # Mises à jour WordPress envoyées en parallèle, par lots de 25 (limite de l'API batch,
+    # refusée pour les médias depuis WordPress 5.9 : repli image par image)
+    WP_UPDATE_CONCURRENCY = 8
+    WP_BATCH_SIZE = 25
+    
+    # Débit maximal vers un site WordPress (requêtes/seconde)
+    WP_RATE_LIMIT = max(float(os.getenv("WP_RATE_LIMIT", 5)), 0.1)
+    WP_RATE_BURST = 5
+
+# Consignes communes à tous les prompts (préfixe stable)
+SYSTEM_PROMPT = """Génère des métadonnées SEO pour cette image WordPress.
+
+Génère un JSON avec:
+- alt_text: description précise (max 125 car)
+- title: titre SEO (max 60 car)  
+- caption: légende engageante (max 160 car)
+- description: description détaillée (max 300 car)
+
+Format JSON uniquement.
+
+"""
+
+JSON_INSTRUCTION = "\n\nRéponds uniquement avec un JSON valide."
+
+class AIUnavailable(Exception):
+    """L'IA n'a pas produit de métadonnées exploitables."""
+
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+# Champs de la médiathèque réellement utilisés (réponses plus légères)
+MEDIA_FIELDS = "id,alt_text,source_url,title"
+
+_TAG_RE = re.compile(r'<[^>]+>')
+
+def strip_html(html: str) -> str:
+    """Retire les balises HTML et décode les entités."""
+    return unescape(_TAG_RE.sub('', html)).strip()
+
+_FENCE_RE = re.compile(r'```(?:json)?\s*(.*?)```', re.DOTALL)
+
+class JsonSpanScanner:
+    """Repère le premier objet {...} équilibré, en ignorant les accolades dans les chaînes."""
+    
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.start = -1
+        self.offset = 0
+    
+    def feed(self, text: str) -> Optional[int]:
+        """Avance sur un morceau de texte ; retourne la fin de l'objet s'il est refermé."""
+        for i, char in enumerate(text):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"' and self.depth > 0:
+                self.in_string = True
+            elif char == '{':
+                if self.depth == 0:
+                    self.start = self.offset + i
+                self.depth += 1
+            elif char == '}' and self.depth > 0:
+                self.depth -= 1
+                if self.depth == 0:
+                    return self.offset + i + 1
+        self.offset += len(text)
+        return None
+
+def find_json_span(text: str) -> Optional[tuple]:
+    """Trouve le premier objet {...} équilibré en une seule passe."""
+    scanner = JsonSpanScanner()
+    end = scanner.feed(text)
+    if end is None:
+        return None
+    return scanner.start, end
+
+def extract_json(text: str) -> Optional[Dict]:
+    """Extrait un objet JSON d'une réponse IA (brut, bloc ``` ou noyé dans du texte)."""
+    candidates = [text.strip()]
+    candidates += [block.strip() for block in _FENCE_RE.findall(text)]
+    
+    for candidate in candidates:
+        try:
+            result = orjson.loads(candidate)
+        except ValueError:
+            span = find_json_span(candidate)
+            if span is None:
+                continue
+            try:
+                result = orjson.loads(candidate[span[0]:span[1]])
+            except ValueError:
+                continue
+        if isinstance(result, dict):
+            return result
+    return None
+
+class TokenBucket:
+    """Limiteur de débit adaptatif à seau de jetons (thread-safe)."""
+    
+    # Succès consécutifs avant de doubler le débit
+    SPEEDUP_AFTER = 20
+    
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.max_rate = rate
+        self.min_rate = rate / 64
+        self.successes = 0
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def acquire(self):
+        """Attend qu'un jeton soit disponible."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+    
+    def adapt(self, response: requests.Response):
+        """Ajuste le débit d'après la réponse (429, en-têtes X-RateLimit-*)."""
+        with self.lock:
+            if response.status_code == 429:
+                self.rate = max(self.min_rate, self.rate / 2)
+                self.successes = 0
+                return
+            
+            remaining = response.headers.get('X-RateLimit-Remaining', '')
+            reset = response.headers.get('X-RateLimit-Reset', '')
+            if remaining.isdigit() and reset.isdigit():
+                window = float(reset)
+                if window > 1e9:  # Horodatage absolu plutôt qu'un délai
+                    window -= time.time()
+                if window > 0:
+                    rate = max(int(remaining), 1) / window
+                    self.rate = min(self.max_rate, max(self.min_rate, rate))
+                    return
+            
+            # Seules les réponses 2xx comptent comme des succès
+            if not 200 <= response.status_code < 300:
+                self.successes = 0
+                return
+            
+            self.successes += 1
+            if self.successes >= self.SPEEDUP_AFTER:
+                self.rate = min(self.max_rate, self.rate * 2)
+                self.successes = 0
+
+class ResultCache:
+    """Cache LRU borné des métadonnées générées, indexé par hash du prompt."""
+    
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.entries: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+    
+    @staticmethod
+    def key(prompt: str) -> str:
+        return hashlib.blake2b(prompt.encode('utf-8'), digest_size=16).hexdigest()
+    
+    def get(self, key: str) -> Optional[Dict]:
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+    
+    def set(self, key: str, value: Dict):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+# Attente maximale entre deux essais ; au-delà, le coupe-circuit prend le relais
+MAX_RETRY_DELAY = 60.0
+
+def retry_delay(response: Optional[requests.Response], attempt: int) -> float:
+    """Délai avant une nouvelle tentative (Retry-After ou backoff exponentiel)."""
+    retry_after = response.headers.get('Retry-After', '') if response is not None else ''
+    if retry_after.isdigit():
+        return min(float(retry_after), MAX_RETRY_DELAY)
+    return 2 ** attempt + random.uniform(0, 0.5)
+
+class CircuitBreaker:
+    """Coupe-circuit : suspend les appels après des échecs répétés."""
+    
+    def __init__(self, threshold: int, window: float, reset_after: float):
+        self.threshold = threshold
+        self.window = window
+        self.reset_after = reset_after
+        self.failures = 0
+        self.first_failure = 0.0
+        self.opened_at: Optional[float] = None
+        self.lock = threading.Lock()
+    
+    def allow(self) -> bool:
+        """Indique si un appel peut être tenté."""
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            # Semi-ouvert : un seul essai par période
+            now = time.monotonic()
+            if now - self.opened_at >= self.reset_after:
+                self.opened_at = now
+                return True
+            return False
+    
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+    
+    def record_failure(self):
+        with self.lock:
+            now = time.monotonic()
+            if self.opened_at is not None:
+                self.opened_at = now
+                return
+            if self.failures == 0 or now - self.first_failure > self.window:
+                self.failures = 0
+                self.first_failure = now
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = now
 
 # Application Flask
 app = Flask(__name__)
@@ -32,35 +328,344 @@ CORS(app)
 class WordPressAIAgent:
     def __init__(self):
         self.config = Config()
-        self.clients = self.load_clients()
-        
-    def load_clients(self) -> Dict:
-        """Charge la base de données des clients."""
-        if os.path.exists(self.config.DB_FILE):
-            with open(self.config.DB_FILE, 'r') as f:
-                return json.load(f)
-        return {"clients": {}, "stats": {"total_processed": 0}}
-    
-    def save_clients(self):
-        """Sauvegarde la base de données."""
-        with open(self.config.DB_FILE, 'w') as f:
-            json.dump(self.clients, f, indent=2)
-    
-    def generate_with_ai(self, prompt: str) -> Optional[Dict]:
-        """Génère les métadonnées avec HuggingFace."""
-        if not self.config.HF_API_KEY:
-            # Mode démo sans clé API
-            return {
-                "alt_text": "Image optimisée par IA",
-                "title": "Titre SEO optimisé",
-                "caption": "Légende engageante pour cette image",
-                "description": "Description détaillée pour le référencement"
+        self._local = threading.local()
+        self.init_database()
+        self.session = self.create_session()
+        self.hf_session = self.create_hf_session()
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._buckets_lock = threading.Lock()
+        self._no_batch_api = set()
+        
+        # Pools de threads partagés entre les requêtes
+        self.fetch_executor = ThreadPoolExecutor(max_workers=self.config.WP_FETCH_CONCURRENCY)
+        self.image_executor = ThreadPoolExecutor(max_workers=self.config.WP_CONCURRENCY)
+        self.update_executor = ThreadPoolExecutor(max_workers=self.config.WP_UPDATE_CONCURRENCY)
+        
+        self.hf_breaker = CircuitBreaker(
+            self.config.CIRCUIT_THRESHOLD,
+            self.config.CIRCUIT_WINDOW,
+            self.config.CIRCUIT_RESET
+        )
+        self.hf_bucket = TokenBucket(self.config.HF_RPM / 60, self.config.HF_BURST)
+        self.results_cache = ResultCache(self.config.AI_CACHE_SIZE)
+        self.load_ai_cache()
+        
+        # File d'attente bornée des sites à traiter
+        self.jobs: Dict[str, Dict] = {}
+        self._jobs_lock = threading.Lock()
+        self.queue: queue.Queue = queue.Queue(maxsize=self.config.QUEUE_SIZE)
+        for _ in range(self.config.WORKERS):
+            threading.Thread(target=self.worker, daemon=True).start()
+        
+    def create_session(self) -> requests.Session:
+        """Crée la session HTTP partagée par tous les threads (WordPress)."""
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.config.HTTP_POOL_CONNECTIONS,
+            pool_maxsize=self.config.HTTP_POOL_MAXSIZE,
+            max_retries=Retry(total=3, backoff_factor=0.3)
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+    
+    def create_hf_session(self) -> requests.Session:
+        """Crée la session HuggingFace (en-têtes d'authentification prédéfinis)."""
+        session = requests.Session()
+        session.headers.update({
+            "Authorization": f"Bearer {self.config.HF_API_KEY}",
+            "Content-Type": "application/json"
+        })
+        session.mount('https://', HTTPAdapter(
+            pool_connections=self.config.HF_POOL_CONNECTIONS,
+            pool_maxsize=self.config.HF_POOL_MAXSIZE
+        ))
+        return session
+    
+    def submit(self, client_id: str, wp_data: Dict) -> str:
+        """Ajoute un site à la file d'attente (lève queue.Full si elle est pleine)."""
+        job_id = uuid.uuid4().hex
+        with self._jobs_lock:
+            self.prune_jobs()
+            self.jobs[job_id] = {
+                'status': 'queued',
+                'client_id': client_id,
+                'processed': 0,
+                'errors': 0,
+                'skipped': 0,
+                'total': 0,
+                'done': False
             }
         
-        headers = {"Authorization": f"Bearer {self.config.HF_API_KEY}"}
+        try:
+            self.queue.put_nowait((job_id, client_id, wp_data))
+        except queue.Full:
+            with self._jobs_lock:
+                del self.jobs[job_id]
+            raise
+        return job_id
+    
+    def worker(self):
+        """Traite les sites de la file d'attente."""
+        while True:
+            job_id, client_id, wp_data = self.queue.get()
+            self.update_job(job_id, status='running')
+            try:
+                result = self.process_wordpress_site(client_id, wp_data)
+                self.update_job(job_id, status='done', done=True, **result)
+            except Exception as e:
+                print(f"Erreur traitement {wp_data['url']}: {e}")
+                self.update_job(job_id, status='error', done=True, error=str(e))
+            finally:
+                self.queue.task_done()
+    
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        """Récupère l'état d'une tâche."""
+        with self._jobs_lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job is not None else None
+    
+    def update_job(self, job_id: str, **fields):
+        """Met à jour l'état d'une tâche."""
+        with self._jobs_lock:
+            self.jobs[job_id].update(fields)
+            if fields.get('done'):
+                self.jobs[job_id]['finished_at'] = time.time()
+    
+    def prune_jobs(self):
+        """Oublie les tâches terminées depuis longtemps (appelé sous verrou)."""
+        limit = time.time() - self.config.JOB_TTL
+        for job_id in [job_id for job_id, job in self.jobs.items()
+                       if job.get('finished_at', limit + 1) < limit]:
+            del self.jobs[job_id]
+    
+    def throttle(self, url: str) -> TokenBucket:
+        """Limite le débit des requêtes vers un même hôte ; retourne son limiteur."""
+        host = urlparse(url).netloc
+        with self._buckets_lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = TokenBucket(self.config.WP_RATE_LIMIT, self.config.WP_RATE_BURST)
+                self._buckets[host] = bucket
+        bucket.acquire()
+        return bucket
+    
+    def close(self):
+        """Arrête les pools et ferme les connexions."""
+        self.fetch_executor.shutdown(wait=False)
+        self.image_executor.shutdown(wait=False)
+        self.update_executor.shutdown(wait=False)
+        self.hf_session.close()
+        self.session.close()
+        
+    def _get_db(self) -> sqlite3.Connection:
+        """Connexion SQLite propre au thread courant."""
+        conn = getattr(self._local, 'db', None)
+        if conn is None:
+            conn = sqlite3.connect(self.config.DB_FILE, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = conn
+        return conn
+    
+    def init_database(self):
+        """Crée les tables et importe l'ancienne base JSON si besoin."""
+        conn = self._get_db()
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS clients ("
+                "id TEXT PRIMARY KEY, stats_json TEXT NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS global_stats ("
+                "id INTEGER PRIMARY KEY CHECK (id = 0), total_processed INTEGER NOT NULL)"
+            )
+            conn.execute("INSERT OR IGNORE INTO global_stats VALUES (0, 0)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS media_pages ("
+                "url TEXT, page INTEGER, etag TEXT, last_modified TEXT, "
+                "body BLOB, total_pages INTEGER, PRIMARY KEY (url, page))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS ai_cache ("
+                "key TEXT PRIMARY KEY, result_json TEXT NOT NULL, ts INTEGER NOT NULL)"
+            )
+        self.migrate_json_database()
+    
+    def migrate_json_database(self):
+        """Importe l'ancienne base JSON, puis la renomme."""
+        if not os.path.exists(self.config.LEGACY_DB_FILE):
+            return
+        
+        with open(self.config.LEGACY_DB_FILE, 'rb') as f:
+            legacy = orjson.loads(f.read())
+        
+        # Une seule transaction : un arrêt en cours d'import n'écrit rien
+        conn = self._get_db()
+        with conn:
+            for client_id, client in legacy.get('clients', {}).items():
+                stats = client.get('stats', {})
+                self._add_stats(
+                    conn, client_id,
+                    stats.get('total_processed', 0),
+                    stats.get('total_errors', 0)
+                )
+        os.replace(self.config.LEGACY_DB_FILE, self.config.LEGACY_DB_FILE + '.migrated')
+    
+    def add_client(self, client_id: str):
+        """Ajoute un client s'il n'existe pas encore."""
+        conn = self._get_db()
+        with conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO clients VALUES (?, ?)",
+                (client_id, '{"total_processed": 0, "total_errors": 0}')
+            )
+    
+    def get_stats(self) -> Dict:
+        """Récupère les statistiques globales et par client."""
+        conn = self._get_db()
+        total = conn.execute("SELECT total_processed FROM global_stats WHERE id = 0").fetchone()[0]
+        clients = {
+            client_id: {'stats': orjson.loads(stats_json)}
+            for client_id, stats_json in conn.execute("SELECT id, stats_json FROM clients")
+        }
+        return {'total_processed': total, 'clients': clients}
+    
+    def generate_with_ai(self, prompt: str) -> Dict:
+        """Génère les métadonnées avec HuggingFace (AIUnavailable en cas d'échec)."""
+        if not self.config.HF_API_KEY:
+            raise AIUnavailable("HF_API_KEY manquante")
+        
+        # Même prompt, même réponse : éviter un appel IA
+        cache_key = ResultCache.key(prompt)
+        cached = self.get_cached_result(cache_key)
+        if cached is not None:
+            return cached
+        
+        request_prompt = prompt
+        for _ in range(self.config.AI_JSON_ATTEMPTS):
+            text = self.query_huggingface(request_prompt)
+            if text is None:
+                break
+            
+            metadata = extract_json(text)
+            if metadata is not None:
+                self.cache_result(cache_key, metadata)
+                return metadata
+            
+            # Redemander un JSON valide
+            request_prompt = prompt + "\n\nTa réponse précédente n'était pas un JSON valide."
+        
+        # Pas de métadonnées génériques : elles écraseraient les données existantes
+        raise AIUnavailable(prompt)
+    
+    def generate_with_ai_batch(self, prompts: List[str]) -> List[Optional[Dict]]:
+        """Génère les métadonnées de plusieurs images en un seul appel HuggingFace (None si échec)."""
+        if not self.config.HF_API_KEY:
+            return [None] * len(prompts)
+        
+        results: List[Optional[Dict]] = [None] * len(prompts)
+        keys = [ResultCache.key(prompt) for prompt in prompts]
+        missing = []
+        for i, key in enumerate(keys):
+            cached = self.get_cached_result(key)
+            if cached is not None:
+                results[i] = cached
+            else:
+                missing.append(i)
+        
+        if not missing:
+            return results
+        
+        texts = self.query_huggingface_batch([prompts[i] for i in missing])
+        if texts is None:
+            # Service indisponible : inutile de réessayer image par image
+            return results
+        
+        for i, text in zip(missing, texts):
+            metadata = extract_json(text) if text else None
+            if metadata is not None:
+                self.cache_result(keys[i], metadata)
+                results[i] = metadata
+            else:
+                # Réponse inexploitable : appel individuel avec réparation
+                try:
+                    results[i] = self.generate_with_ai(prompts[i])
+                except AIUnavailable:
+                    pass
+        return results
+    
+    def post_huggingface(self, payload: Dict) -> Optional[requests.Response]:
+        """Envoie une requête à HuggingFace avec réessais ; retourne la réponse (streaming)."""
+        # Service en panne : ne pas attendre les timeouts
+        if not self.hf_breaker.allow():
+            return None
+        
+        body = orjson.dumps(payload)  # Encodé une seule fois pour tous les essais
+        
+        for attempt in range(self.config.HF_RETRIES):
+            self.hf_bucket.acquire()
+            try:
+                response = self.hf_session.post(
+                    self.config.HF_API_URL,
+                    data=body,
+                    timeout=30,
+                    stream=True
+                )
+                self.hf_bucket.adapt(response)
+                if response.status_code == 200:
+                    self.hf_breaker.record_success()
+                    return response
+                response.close()
+                
+                # Seules les erreurs temporaires sont réessayées
+                if response.status_code not in (429, 503):
+                    break
+                delay = retry_delay(response, attempt)
+            except requests.RequestException as e:
+                print(f"Erreur IA: {e}")
+                delay = retry_delay(None, attempt)
+            
+            if attempt + 1 < self.config.HF_RETRIES:
+                time.sleep(delay)
+        
+        self.hf_breaker.record_failure()
+        return None
+    
+    def query_huggingface(self, prompt: str) -> Optional[str]:
+        """Envoie un prompt à HuggingFace et retourne le texte généré."""
+        payload = {
+            "inputs": SYSTEM_PROMPT + prompt + JSON_INSTRUCTION,
+            "parameters": {
+                "max_new_tokens": 200,
+                "temperature": 0.7,
+                "return_full_text": False
+            },
+            "stream": True
+        }
+        
+        response = self.post_huggingface(payload)
+        if response is None:
+            return None
         
+        with response:
+            try:
+                # Modèle sans streaming : réponse JSON complète
+                if not response.headers.get('Content-Type', '').startswith('text/event-stream'):
+                    result = orjson.loads(response.content)
+                    if isinstance(result, list) and result and isinstance(result[0], dict):
+                        return result[0].get('generated_text', '')
+                    return None
+                
+                return self.read_stream(response)
+            except (requests.RequestException, ValueError) as e:
+                print(f"Erreur IA: {e}")
+                return None
+    
+    def query_huggingface_batch(self, prompts: List[str]) -> Optional[List[Optional[str]]]:
+        """Envoie plusieurs prompts en un seul appel (None si le service est indisponible)."""
         payload = {
-            "inputs": prompt + "\n\nRéponds uniquement avec un JSON valide.",
+            "inputs": [SYSTEM_PROMPT + prompt + JSON_INSTRUCTION for prompt in prompts],
             "parameters": {
                 "max_new_tokens": 200,
                 "temperature": 0.7,
@@ -68,35 +673,77 @@ class WordPressAIAgent:
             }
         }
         
-        try:
-            response = requests.post(
-                self.config.HF_API_URL,
-                headers=headers,
-                json=payload,
-                timeout=30
+        response = self.post_huggingface(payload)
+        if response is None:
+            return None
+        
+        with response:
+            try:
+                result = orjson.loads(response.content)
+            except (requests.RequestException, ValueError) as e:
+                print(f"Erreur IA: {e}")
+                result = None
+        
+        # Réponse mal formée : chaque prompt sera repris individuellement
+        if not isinstance(result, list) or len(result) != len(prompts):
+            return [None] * len(prompts)
+        
+        texts = []
+        for item in result:
+            # Selon le modèle : [{...}, ...] ou [[{...}], ...]
+            if isinstance(item, list):
+                item = item[0] if item else {}
+            texts.append(item.get('generated_text') if isinstance(item, dict) else None)
+        return texts
+    
+    def read_stream(self, response: requests.Response) -> str:
+        """Lit un flux SSE et s'arrête dès que l'objet JSON est refermé."""
+        text = ''
+        scanner = JsonSpanScanner()
+        for line in response.iter_lines():
+            if not line.startswith(b'data:'):
+                continue
+            token = orjson.loads(line[5:]).get('token', {}).get('text', '')
+            text += token
+            if scanner.feed(token) is not None:
+                break
+        return text
+    
+    def load_ai_cache(self):
+        """Charge en mémoire les réponses IA les plus récentes."""
+        rows = self._get_db().execute(
+            "SELECT key, result_json FROM ("
+            "SELECT key, result_json, ts FROM ai_cache ORDER BY ts DESC LIMIT ?"
+            ") ORDER BY ts",
+            (self.config.AI_CACHE_SIZE,)
+        )
+        for key, result_json in rows:
+            self.results_cache.set(key, orjson.loads(result_json))
+    
+    def get_cached_result(self, key: str) -> Optional[Dict]:
+        """Cherche une réponse IA en mémoire, puis en base."""
+        cached = self.results_cache.get(key)
+        if cached is not None:
+            return cached
+        
+        row = self._get_db().execute(
+            "SELECT result_json FROM ai_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        metadata = orjson.loads(row[0])
+        self.results_cache.set(key, metadata)
+        return metadata
+    
+    def cache_result(self, key: str, metadata: Dict):
+        """Met en cache une réponse IA (mémoire et base)."""
+        self.results_cache.set(key, metadata)
+        conn = self._get_db()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO ai_cache VALUES (?, ?, ?)",
+                (key, orjson.dumps(metadata).decode('utf-8'), int(time.time()))
             )
-            
-            if response.status_code == 200:
-                result = response.json()
-                if isinstance(result, list) and len(result) > 0:
-                    text = result[0].get('generated_text', '')
-                    
-                    # Extraire le JSON
-                    json_start = text.find('{')
-                    json_end = text.rfind('}') + 1
-                    if json_start >= 0 and json_end > json_start:
-                        json_str = text[json_start:json_end]
-                        return json.loads(json_str)
-        except Exception as e:
-            print(f"Erreur IA: {e}")
-        
-        # Fallback
-        return {
-            "alt_text": "Image du site WordPress",
-            "title": "Image optimisée",
-            "caption": "Image automatiquement optimisée",
-            "description": "Description générée automatiquement"
-        }
     
     def process_wordpress_site(self, client_id: str, wp_data: Dict):
         """Traite un site WordPress."""
@@ -106,32 +753,51 @@ class WordPressAIAgent:
         
         print(f"🤖 Traitement du site {wp_url} pour le client {client_id}")
         
-        # Récupérer les images
-        images = self.fetch_wordpress_images(wp_url, wp_user, wp_password)
+        # Récupérer les images sans texte alternatif
+        todo = list(self.iter_wordpress_images(
+            wp_url, wp_user, wp_password,
+            need=self.config.MAX_IMAGES_PER_RUN
+        ))
+        
+        # Mode démo sans clé API : aucune écriture dans WordPress
+        if not self.config.HF_API_KEY:
+            return {
+                "processed": 0,
+                "errors": 0,
+                "skipped": len(todo),
+                "total": len(todo)
+            }
         
         processed = 0
         errors = 0
         
-        for image in images[:10]:  # Limiter à 10 pour le test
-            if not image.get('alt_text'):
-                # Générer avec l'IA
-                context = self.get_image_context(wp_url, wp_user, wp_password, image)
-                prompt = self.create_prompt(context)
-                metadata = self.generate_with_ai(prompt)
-                
-                if metadata:
-                    # Mettre à jour WordPress
-                    success = self.update_wordpress_image(
-                        wp_url, wp_user, wp_password, 
-                        image['id'], metadata
-                    )
-                    
-                    if success:
-                        processed += 1
-                    else:
-                        errors += 1
-                
-                time.sleep(1)  # Pause entre chaque image
+        # Générer les métadonnées par lots (un appel HuggingFace par lot)
+        prompts = [
+            self.create_prompt(self.get_image_context(wp_url, wp_user, wp_password, image))
+            for image in todo
+        ]
+        size = self.config.HF_BATCH_SIZE
+        batches = self.image_executor.map(
+            self.generate_with_ai_batch,
+            [prompts[i:i + size] for i in range(0, len(prompts), size)]
+        )
+        metadatas = [metadata for batch in batches for metadata in batch]
+        
+        # Sans réponse de l'IA, l'image n'est pas modifiée dans WordPress
+        updates = []
+        for image, metadata in zip(todo, metadatas):
+            if metadata:
+                updates.append((image['id'], metadata))
+            else:
+                errors += 1
+        
+        # Envoyer les mises à jour WordPress par lots
+        results = self.batch_update_wordpress_images(wp_url, wp_user, wp_password, updates)
+        for success in results:
+            if success:
+                processed += 1
+            else:
+                errors += 1
         
         # Mettre à jour les stats
         self.update_client_stats(client_id, processed, errors)
@@ -139,43 +805,115 @@ class WordPressAIAgent:
         return {
             "processed": processed,
             "errors": errors,
-            "total": len(images)
+            "skipped": 0,
+            "total": len(todo)
         }
     
-    def fetch_wordpress_images(self, wp_url: str, user: str, password: str) -> List[Dict]:
-        """Récupère les images d'un site WordPress."""
-        images = []
-        page = 1
-        
+    def iter_wordpress_images(self, wp_url: str, user: str, password: str,
+                              need: int) -> Iterator[Dict]:
+        """Parcourt la médiathèque et produit jusqu'à `need` images sans texte alternatif."""
+        url = f"{wp_url}/wp-json/wp/v2/media"
         auth = (user, password)
+        if need <= 0:
+            return
+        
+        # La première page donne aussi le nombre total de pages
+        first = self.fetch_media_page(url, auth, 1)
+        if first is None:
+            return
+        batch, total_pages = first
+        batches = [batch]
+        next_page = 2
         
         while True:
-            try:
-                response = requests.get(
-                    f"{wp_url}/wp-json/wp/v2/media",
-                    params={'per_page': 100, 'page': page},
-                    auth=auth,
-                    timeout=30
-                )
-                
-                if response.status_code == 200:
-                    batch = response.json()
-                    if not batch:
-                        break
-                    images.extend(batch)
-                    page += 1
-                else:
-                    break
-            except:
-                break
+            for batch in batches:
+                for image in batch:
+                    if not image.get('alt_text'):
+                        yield image
+                        need -= 1
+                        if need <= 0:
+                            return
+            
+            if next_page > total_pages:
+                return
+            
+            # Fenêtre suivante de pages, récupérées en parallèle
+            pages = range(next_page, min(next_page + self.config.WP_FETCH_CONCURRENCY, total_pages + 1))
+            next_page = pages.stop
+            results = self.fetch_executor.map(
+                lambda page: self.fetch_media_page(url, auth, page),
+                pages
+            )
+            batches = [result[0] for result in results if result is not None]
+    
+    def get_cached_page(self, url: str, page: int) -> Optional[Dict]:
+        """Récupère une page de médiathèque en cache (ETag, Last-Modified, corps)."""
+        row = self._get_db().execute(
+            "SELECT etag, last_modified, body, total_pages FROM media_pages "
+            "WHERE url = ? AND page = ?",
+            (url, page)
+        ).fetchone()
+        if row is None:
+            return None
+        return {'etag': row[0], 'last_modified': row[1], 'body': row[2], 'total_pages': row[3]}
+    
+    def cache_page(self, url: str, page: int, etag: Optional[str], last_modified: Optional[str],
+                   body: bytes, total_pages: int):
+        """Met en cache une page de médiathèque."""
+        conn = self._get_db()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO media_pages VALUES (?, ?, ?, ?, ?, ?)",
+                (url, page, etag, last_modified, body, total_pages)
+            )
+    
+    def fetch_media_page(self, url: str, auth: tuple, page: int) -> Optional[tuple]:
+        """Récupère une page de la médiathèque (images, nombre total de pages)."""
+        # Requête conditionnelle si la page est déjà en cache
+        cached = self.get_cached_page(url, page)
+        headers = {}
+        if cached is not None:
+            if cached['etag']:
+                headers['If-None-Match'] = cached['etag']
+            if cached['last_modified']:
+                headers['If-Modified-Since'] = cached['last_modified']
+        
+        bucket = self.throttle(url)
         
-        return images
+        try:
+            response = self.session.get(
+                url,
+                params={'per_page': 100, 'page': page, '_fields': MEDIA_FIELDS},
+                auth=auth,
+                headers=headers,
+                timeout=30
+            )
+            bucket.adapt(response)
+            
+            # Page inchangée : réutiliser le corps en cache
+            if response.status_code == 304 and cached is not None:
+                return orjson.loads(cached['body']), cached['total_pages']
+            
+            if response.status_code == 200:
+                batch = orjson.loads(response.content)
+                total_pages = int(response.headers.get('X-WP-TotalPages', 1))
+                etag = response.headers.get('ETag')
+                last_modified = response.headers.get('Last-Modified')
+                if etag or last_modified:
+                    self.cache_page(
+                        url, page, etag, last_modified,
+                        response.content, total_pages
+                    )
+                return batch, total_pages
+        except (requests.RequestException, ValueError) as e:
+            print(f"Erreur médiathèque (page {page}): {e}")
+        return None
     
     def get_image_context(self, wp_url: str, user: str, password: str, image: Dict) -> Dict:
         """Récupère le contexte d'une image."""
         context = {
             'image_url': image.get('source_url', ''),
-            'image_title': image.get('title', {}).get('rendered', ''),
+            'image_title': strip_html(image.get('title', {}).get('rendered', '')),
             'page_title': '',
             'page_content': ''
         }
@@ -184,56 +922,129 @@ class WordPressAIAgent:
         return context
     
     def create_prompt(self, context: Dict) -> str:
-        """Crée le prompt pour l'IA."""
-        return f"""Génère des métadonnées SEO pour cette image WordPress.
-
-URL de l'image: {context['image_url']}
-
-Génère un JSON avec:
-- alt_text: description précise (max 125 car)
-- title: titre SEO (max 60 car)  
-- caption: légende engageante (max 160 car)
-- description: description détaillée (max 300 car)
-
-Format JSON uniquement."""
+        """Crée la partie variable du prompt (le contexte de l'image)."""
+        return f"URL de l'image: {context['image_url']}"
     
     def update_wordpress_image(self, wp_url: str, user: str, password: str, 
                              image_id: int, metadata: Dict) -> bool:
         """Met à jour une image dans WordPress."""
         auth = (user, password)
         
+        bucket = self.throttle(wp_url)
+        
         try:
-            response = requests.post(
+            response = self.session.post(
                 f"{wp_url}/wp-json/wp/v2/media/{image_id}",
-                json=metadata,
+                data=orjson.dumps(metadata),
+                headers=JSON_HEADERS,
                 auth=auth,
                 timeout=30
             )
+            bucket.adapt(response)
             return response.status_code == 200
         except:
             return False
     
-    def update_client_stats(self, client_id: str, processed: int, errors: int):
-        """Met à jour les statistiques."""
-        if client_id not in self.clients['clients']:
-            self.clients['clients'][client_id] = {
-                'stats': {'total_processed': 0, 'total_errors': 0}
-            }
+    def batch_update_wordpress_images(self, wp_url: str, user: str, password: str,
+                                      updates: List[tuple]) -> List[bool]:
+        """Met à jour plusieurs images via l'API batch de WordPress (image par image sinon)."""
+        size = self.config.WP_BATCH_SIZE
+        chunks = [updates[i:i + size] for i in range(0, len(updates), size)]
+        results = self.update_executor.map(
+            lambda chunk: self.post_batch(wp_url, user, password, chunk),
+            chunks
+        )
+        return [success for chunk_results in results for success in chunk_results]
+    
+    def post_batch(self, wp_url: str, user: str, password: str, chunk: List[tuple]) -> List[bool]:
+        """Envoie un lot de mises à jour (image par image si l'API batch est refusée)."""
+        if wp_url in self._no_batch_api:
+            return self.update_each(wp_url, user, password, chunk)
+        
+        payload = {
+            "requests": [
+                {"method": "POST", "path": f"/wp/v2/media/{image_id}", "body": metadata}
+                for image_id, metadata in chunk
+            ]
+        }
+        
+        bucket = self.throttle(wp_url)
         
-        self.clients['clients'][client_id]['stats']['total_processed'] += processed
-        self.clients['clients'][client_id]['stats']['total_errors'] += errors
-        self.clients['stats']['total_processed'] += processed
+        try:
+            response = self.session.post(
+                f"{wp_url}/wp-json/batch/v1",
+                params={'validation': 'require-all-validate'},
+                data=orjson.dumps(payload),
+                headers=JSON_HEADERS,
+                auth=(user, password),
+                timeout=60
+            )
+            bucket.adapt(response)
+            
+            # WordPress < 5.6 : pas d'API batch
+            if response.status_code == 404:
+                self._no_batch_api.add(wp_url)
+                return self.post_batch(wp_url, user, password, chunk)
+            
+            result = orjson.loads(response.content)
+        except (requests.RequestException, ValueError) as e:
+            print(f"Erreur batch WordPress: {e}")
+            return [False] * len(chunk)
         
-        self.save_clients()
+        if not isinstance(result, dict) or not isinstance(result.get('responses'), list):
+            return [False] * len(chunk)
+        responses = [item if isinstance(item, dict) else {} for item in result['responses']]
+        
+        if result.get('failed') == 'validation':
+            # WordPress 5.9+ : les médias n'acceptent plus l'API batch
+            if any(isinstance(item.get('body'), dict)
+                   and item['body'].get('code') == 'rest_batch_not_allowed'
+                   for item in responses):
+                self._no_batch_api.add(wp_url)
+            # Reprendre image par image : seules les images invalides échouent
+            return self.update_each(wp_url, user, password, chunk)
+        
+        if result.get('failed') or len(responses) != len(chunk):
+            return [False] * len(chunk)
+        return [item.get('status') == 200 for item in responses]
+    
+    def update_each(self, wp_url: str, user: str, password: str, chunk: List[tuple]) -> List[bool]:
+        """Met à jour les images d'un lot une par une."""
+        return [
+            self.update_wordpress_image(wp_url, user, password, image_id, metadata)
+            for image_id, metadata in chunk
+        ]
+    
+    def update_client_stats(self, client_id: str, processed: int, errors: int):
+        """Met à jour les statistiques."""
+        conn = self._get_db()
+        with conn:
+            self._add_stats(conn, client_id, processed, errors)
+    
+    def _add_stats(self, conn: sqlite3.Connection, client_id: str, processed: int, errors: int):
+        """Ajoute des compteurs à un client (dans la transaction de l'appelant)."""
+        conn.execute(
+            "INSERT OR IGNORE INTO clients VALUES (?, ?)",
+            (client_id, '{"total_processed": 0, "total_errors": 0}')
+        )
+        conn.execute(
+            "UPDATE clients SET stats_json = json_set(stats_json, "
+            "'$.total_processed', json_extract(stats_json, '$.total_processed') + ?, "
+            "'$.total_errors', json_extract(stats_json, '$.total_errors') + ?) "
+            "WHERE id = ?",
+            (processed, errors, client_id)
+        )
+        conn.execute(
+            "UPDATE global_stats SET total_processed = total_processed + ? WHERE id = 0",
+            (processed,)
+        )
 
 # Instance globale
 agent = WordPressAIAgent()
+atexit.register(agent.close)
 
-# Routes Flask
-@app.route('/')
-def home():
-    """Page d'accueil."""
-    return render_template_string('''
+# Page d'accueil statique, encodée une seule fois au démarrage
+INDEX_HTML = '''
 <!DOCTYPE html>
 <html>
 <head>
@@ -384,8 +1195,17 @@ def home():
                 const result = await response.json();
                 
                 if (response.ok) {
-                    status.className = 'status success';
-                    status.textContent = `✅ Succès! ${result.processed} images optimisées`;
+                    const job = await waitForJob(result.job_id);
+                    if (job.status === 'done' && job.skipped) {
+                        status.className = 'status error';
+                        status.textContent = `⚠️ Mode démo : ${job.skipped} images ignorées (HF_API_KEY manquante)`;
+                    } else if (job.status === 'done') {
+                        status.className = 'status success';
+                        status.textContent = `✅ Succès! ${job.processed} images optimisées`;
+                    } else {
+                        status.className = 'status error';
+                        status.textContent = `❌ Erreur: ${job.error}`;
+                    }
                     loadStats();
                 } else {
                     status.className = 'status error';
@@ -397,6 +1217,20 @@ def home():
             }
         }
         
+        async function waitForJob(jobId) {
+            while (true) {
+                await new Promise(resolve => setTimeout(resolve, 2000));
+                const response = await fetch(`/api/jobs/${jobId}`);
+                const job = await response.json();
+                if (!response.ok) {
+                    throw new Error(job.error);
+                }
+                if (job.done) {
+                    return job;
+                }
+            }
+        }
+        
         async function loadStats() {
             try {
                 const response = await fetch('/api/stats');
@@ -416,7 +1250,25 @@ def home():
     </script>
 </body>
 </html>
-    ''')
+'''
+INDEX_BYTES = INDEX_HTML.encode('utf-8')
+INDEX_ETAG = hashlib.md5(INDEX_BYTES).hexdigest()
+INDEX_GZIP = gzip.compress(INDEX_BYTES, 9)
+
+# Routes Flask
+@app.route('/')
+def home():
+    """Page d'accueil."""
+    if request.accept_encodings['gzip'] > 0:
+        response = Response(INDEX_GZIP, mimetype='text/html')
+        response.headers['Content-Encoding'] = 'gzip'
+        response.set_etag(INDEX_ETAG + '-gzip')
+    else:
+        response = Response(INDEX_BYTES, mimetype='text/html')
+        response.set_etag(INDEX_ETAG)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'public, max-age=300'
+    return response.make_conditional(request)
 
 @app.route('/api/process', methods=['POST'])
 def process_site():
@@ -434,26 +1286,28 @@ def process_site():
         return jsonify({'error': 'Données manquantes'}), 400
     
     # Ajouter le client
-    if client_id not in agent.clients['clients']:
-        agent.clients['clients'][client_id] = {
-            'sites': [],
-            'stats': {'total_processed': 0, 'total_errors': 0}
-        }
-    
-    agent.save_clients()
+    agent.add_client(client_id)
     
-    # Traiter directement (version simplifiée)
-    result = agent.process_wordpress_site(client_id, wp_data)
+    # Passer par la file d'attente des workers
+    try:
+        job_id = agent.submit(client_id, wp_data)
+    except queue.Full:
+        return jsonify({'error': "File d'attente pleine, réessayez plus tard"}), 503
     
-    return jsonify(result)
+    return jsonify({'job_id': job_id}), 202
+
+@app.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    """Récupère l'état d'un traitement."""
+    job = agent.get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Tâche introuvable'}), 404
+    return jsonify(job)
 
 @app.route('/api/stats')
 def get_stats():
     """Récupère les statistiques."""
-    return jsonify({
-        'total_processed': agent.clients['stats']['total_processed'],
-        'clients': agent.clients['clients']
-    })
+    return jsonify(agent.get_stats())
 
 if __name__ == '__main__':
     print("🚀 Agent démarré sur http://localhost:5000")
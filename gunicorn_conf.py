@@ -0,0 +1,17 @@
+"""
+Configuration Gunicorn pour la production
+Lancement : gunicorn -c gunicorn_conf.py agent:app
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', 5000)}"
+
+# Un seul processus : la file d'attente et l'état des tâches sont en mémoire.
+# Les requêtes sont servies par des threads (les appels HTTP relâchent le GIL).
+workers = 1
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", 32))
+
+keepalive = 30
+timeout = 300